@@ -0,0 +1,22 @@
+"""Shared Docker client for the package.
+
+Creating a ``docker.DockerClient`` opens a fresh Unix-socket HTTP session
+each time, which dominates init latency for short-lived sandbox objects.
+All sandbox code should obtain its client through ``_client()`` so the
+connection is set up once per process and reused.
+"""
+import docker
+
+_CLIENT = None
+
+# docker-py's default adapter keeps only 10 pooled connections; concurrent
+# exec calls from a pool of workers serialize once that fills up.
+_MAX_POOL_SIZE = 32
+
+
+def _client():
+    """Return the process-wide Docker client, creating it on first use."""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = docker.from_env(max_pool_size=_MAX_POOL_SIZE)
+    return _CLIENT
@@ -1,55 +1,74 @@
-import docker
+import collections
+import threading
 import uuid
-import time
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from ._docker import _client
 
 class ContainerPool:
-    """Simple pool of pre-created Docker containers for code execution."""
-    
+    """
+    Simple pool of pre-created Docker containers for code execution.
+
+    There is no per-container in-use accounting: a container is in use
+    exactly when it is absent from the free-list deque, and `containers`
+    remains the canonical list for cleanup(). acquire/release only touch
+    the deque under the condition's lock.
+    """
+
     def __init__(self, pool_size=2, image_name="python:3.9-slim"):
         self.pool_size = pool_size
         self.image_name = image_name
-        self.client = docker.from_env()
+        self.client = _client()
         self.containers = []
-        self.in_use = set()
+        self._cond = threading.Condition()
+        self._free = collections.deque()
         self._init_pool()
     
     def _init_pool(self):
-        """Create warm containers once."""
+        """Create warm containers once, starting them in parallel."""
         print(f"[ContainerPool] Creating {self.pool_size} warm containers...", file=sys.stderr, flush=True)
-        for i in range(self.pool_size):
-            try:
-                c = self.client.containers.run(
-                    self.image_name,
-                    name=f"sandbox_pool_{uuid.uuid4().hex[:8]}",
-                    command="tail -f /dev/null",
-                    detach=True,
-                    network_mode="none",
-                    mem_limit="100m",
-                    cpu_period=100000,
-                    cpu_quota=50000,
-                    remove=True
-                )
-                self.containers.append(c)
-                print(f"[ContainerPool] Container {i+1}/{self.pool_size} ready", file=sys.stderr, flush=True)
-            except Exception as e:
-                print(f"[ContainerPool] Failed to create container: {e}", file=sys.stderr, flush=True)
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            futures = [executor.submit(self._create_one, i) for i in range(self.pool_size)]
+            for future in futures:
+                future.result()
+
+    def _create_one(self, i):
+        """Create a single pool container and add it to the free list."""
+        try:
+            c = self.client.containers.run(
+                self.image_name,
+                name=f"sandbox_pool_{uuid.uuid4().hex[:8]}",
+                command="tail -f /dev/null",
+                detach=True,
+                network_mode="none",
+                mem_limit="100m",
+                cpu_period=100000,
+                cpu_quota=50000,
+                remove=True
+            )
+        except Exception as e:
+            print(f"[ContainerPool] Failed to create container: {e}", file=sys.stderr, flush=True)
+            return None
+        with self._cond:
+            self.containers.append(c)
+            self._free.append(c)
+            self._cond.notify()
+        print(f"[ContainerPool] Container {i+1}/{self.pool_size} ready", file=sys.stderr, flush=True)
+        return c
     
     def acquire(self, timeout=30):
         """Get an available container from the pool."""
-        start = time.time()
-        while time.time() - start < timeout:
-            for c in self.containers:
-                cid = c.id
-                if cid not in self.in_use:
-                    self.in_use.add(cid)
-                    return c
-            time.sleep(0.1)
-        raise RuntimeError("No containers available in pool")
-    
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._free, timeout=timeout):
+                raise RuntimeError("No containers available in pool")
+            return self._free.popleft()
+
     def release(self, container):
         """Return a container to the pool."""
-        self.in_use.discard(container.id)
+        with self._cond:
+            self._free.append(container)
+            self._cond.notify()
     
     def cleanup(self):
         """Stop all containers."""
@@ -1,5 +1,8 @@
 import docker
-import shlex
+import hashlib
+import socket
+import struct
+import threading
 import uuid
 import textwrap
 import os
@@ -9,6 +12,97 @@ from io import BytesIO
 import time
 import sys
 
+from docker.utils.socket import frames_iter
+
+from ._docker import _client
+
+# Per-request debug logging is off by default; every guarded print costs a
+# write syscall on the hot path.
+_DEBUG = bool(os.environ.get("SANDBOX_DEBUG"))
+
+# Image with the default package set pre-installed, built from
+# docker/Dockerfile.base. Used for the persistent container when available
+# so first boot skips the runtime pip install.
+_BAKED_IMAGE = "aics/base:py39-preinstalled"
+
+# How long to wait for a dispatcher reply before declaring the warm
+# interpreter wedged. Generous so long-running snippets still complete;
+# the one-shot exec path has no such limit, matching the baseline.
+_DISPATCH_TIMEOUT = 300
+
+# Long-lived interpreter that runs inside the container and executes code
+# snippets sent over stdin as "<byte-length>\n<code>" frames. Each reply is
+# "<exit_code> <stdout-bytes> <stderr-bytes>\n" followed by both payloads,
+# mirroring what a one-shot python exec would report, so callers can apply
+# the same error formatting on either path. Output is captured at the fd
+# level (dup2 around the exec), so subprocesses, os.write and C extensions
+# are caught too and cannot corrupt the protocol stream; fd 0 is swapped to
+# /dev/null so snippets that read stdin hit EOF instead of stealing protocol
+# bytes. Each snippet gets fresh globals, but imports stay cached in
+# sys.modules, so CPython startup is paid only once.
+_DISPATCHER_SRC = textwrap.dedent("""
+    import os
+    import sys
+    import tempfile
+    import traceback
+
+    inp = sys.stdin.buffer
+    out = sys.stdout.buffer
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    while True:
+        header = inp.readline()
+        if not header:
+            break
+        n = int(header)
+        src = inp.read(n).decode("utf-8")
+        out_file = tempfile.TemporaryFile()
+        err_file = tempfile.TemporaryFile()
+        saved = [os.dup(fd) for fd in (0, 1, 2)]
+        old_stdin = sys.stdin
+        exit_code = 0
+        try:
+            sys.stdin = open(os.devnull)
+            os.dup2(devnull, 0)
+            os.dup2(out_file.fileno(), 1)
+            os.dup2(err_file.fileno(), 2)
+            try:
+                exec(compile(src, "<sandbox>", "exec"), {"__name__": "__main__"})
+            except SystemExit as e:
+                if isinstance(e.code, int):
+                    exit_code = e.code
+                elif e.code is not None:
+                    sys.stderr.write(str(e.code) + "\\n")
+                    exit_code = 1
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            except Exception:
+                pass
+            if sys.stdin is not old_stdin:
+                try:
+                    sys.stdin.close()
+                except Exception:
+                    pass
+            sys.stdin = old_stdin
+            for fd, saved_fd in zip((0, 1, 2), saved):
+                os.dup2(saved_fd, fd)
+                os.close(saved_fd)
+        out_file.seek(0)
+        out_bytes = out_file.read()
+        out_file.close()
+        err_file.seek(0)
+        err_bytes = err_file.read()
+        err_file.close()
+        out.write(("%d %d %d\\n" % (exit_code, len(out_bytes), len(err_bytes))).encode("ascii"))
+        out.write(out_bytes)
+        out.write(err_bytes)
+        out.flush()
+""")
+
 class AICodeSandbox:
     """
     A sandbox environment for executing Python code safely.
@@ -35,10 +129,15 @@ class AICodeSandbox:
             cpu_period (int, optional): CPU period for the sandbox. Defaults to 100000.
             cpu_quota (int, optional): CPU quota for the sandbox. Defaults to 50000.
         """
-        self.client = docker.from_env()
+        self.client = _client()
+        self.api = self.client.api
         self.container = None
         self.temp_image = None
         self.pool = None
+        self._dispatch_lock = threading.Lock()
+        self._dispatch_sock = None
+        self._dispatch_frames = None
+        self._dispatch_buf = b''
         self._setup_sandbox(custom_image, packages, network_mode, mem_limit, cpu_period, cpu_quota)
 
     def _setup_sandbox(self, custom_image, packages, network_mode, mem_limit, cpu_period, cpu_quota):
@@ -53,19 +152,13 @@ class AICodeSandbox:
         if custom_image is None and packages is None:
             try:
                 self.container = self.client.containers.get("sandbox_persistent")
-                # Check if container is running, start it if not
-                self.container.reload()
+                # containers.get already did an inspect; its cached status is
+                # fresh enough, so skip the redundant reload round-trip.
                 if self.container.status != 'running':
                     print(f"[SANDBOX] Container sandbox_persistent is {self.container.status}, starting it...", file=sys.stderr, flush=True)
+                    start_ts = int(time.time())
                     self.container.start()
-                    # Wait for container to be fully running
-                    for _ in range(10):
-                        self.container.reload()
-                        if self.container.status == 'running':
-                            break
-                        time.sleep(0.5)
-                    if self.container.status != 'running':
-                        raise Exception(f"Failed to start container, status: {self.container.status}")
+                    self._wait_for_start(self.container, start_ts)
                 return  # Reuse existing persistent container
             except docker.errors.NotFound:
                 pass  # Container doesn't exist, will create new one below
@@ -78,20 +171,43 @@ class AICodeSandbox:
                 except:
                     pass
             
-            # First time setup: create persistent container with default packages
-            packages = default_packages
-        
+            # First time setup: prefer the pre-baked default image (built from
+            # docker/Dockerfile.base) over pip-installing the default packages
+            # at runtime
+            try:
+                self.client.images.get(_BAKED_IMAGE)
+                custom_image = _BAKED_IMAGE
+            except docker.errors.ImageNotFound:
+                try:
+                    self.client.images.pull(_BAKED_IMAGE)
+                    custom_image = _BAKED_IMAGE
+                except Exception:
+                    packages = default_packages
+            except Exception:
+                packages = default_packages
+
         image_name = custom_image or "python:3.9-slim"
         
-        # Build custom image if packages are provided
+        # Build custom image if packages are provided. Built images are tagged
+        # by a hash of the base image plus package set, so the same combination
+        # is only ever pip-installed once, even across process restarts.
         if packages:
-            dockerfile = f"FROM {image_name}\nRUN pip install {' '.join(packages)}"
-            dockerfile_obj = BytesIO(dockerfile.encode('utf-8'))
-            self.temp_image = self.client.images.build(fileobj=dockerfile_obj, rm=True)[0]
-            image_name = self.temp_image.id
+            cache_key = hashlib.sha256(
+                "\n".join([image_name] + sorted(packages)).encode('utf-8')
+            ).hexdigest()[:16]
+            tag = f"aics_pkgs_{cache_key}"
+            try:
+                self.client.images.get(tag)
+            except docker.errors.ImageNotFound:
+                dockerfile = f"FROM {image_name}\nRUN pip install {' '.join(packages)}"
+                dockerfile_obj = BytesIO(dockerfile.encode('utf-8'))
+                self.client.images.build(fileobj=dockerfile_obj, tag=tag, rm=True)
+            image_name = tag
 
         # Create new container
-        is_default_setup = custom_image is None and packages is not None and set(packages) == set(default_packages)
+        is_default_setup = custom_image == _BAKED_IMAGE or (
+            custom_image is None and packages is not None and set(packages) == set(default_packages)
+        )
         container_name = "sandbox_persistent" if is_default_setup else f"python_sandbox_{uuid.uuid4().hex[:8]}"
         self.container = self.client.containers.run(
             image_name,
@@ -106,6 +222,37 @@ class AICodeSandbox:
         )
 
 
+    def _wait_for_start(self, container, since, timeout=5):
+        """
+        Block until the daemon reports the container running.
+
+        Waits on the Docker event stream for the container's 'start' event,
+        which wakes up as soon as the daemon emits it instead of polling on a
+        500ms interval. Falls back to the old reload/sleep poll if the event
+        stream is unavailable.
+        """
+        try:
+            events = self.client.events(
+                decode=True,
+                filters={"container": container.id, "event": "start"},
+                since=since,
+                until=since + timeout,
+            )
+            try:
+                for _ in events:
+                    break
+            finally:
+                events.close()
+            container.reload()
+        except Exception:
+            for _ in range(10):
+                container.reload()
+                if container.status == 'running':
+                    break
+                time.sleep(0.5)
+        if container.status != 'running':
+            raise Exception(f"Failed to start container, status: {container.status}")
+
     def write_file(self, filename, content):
         """
         Write content to a file in the sandbox, creating directories if they don't exist.
@@ -117,13 +264,6 @@ class AICodeSandbox:
         Raises:
             Exception: If writing to the file fails.
         """
-        directory = os.path.dirname(filename)
-        if directory:
-            mkdir_command = f'mkdir -p {shlex.quote(directory)}'
-            mkdir_result = self.container.exec_run(["sh", "-c", mkdir_command])
-            if mkdir_result.exit_code != 0:
-                raise Exception(f"Failed to create directory: {mkdir_result.output.decode('utf-8')}")
-
         tar_stream = io.BytesIO()
         with tarfile.open(fileobj=tar_stream, mode='w') as tar:
             if isinstance(content, str):
@@ -136,14 +276,26 @@ class AICodeSandbox:
 
         tar_stream.seek(0)
 
+        # The common case is writing into a directory that already exists, so
+        # try the single put_archive round-trip first and only pay the mkdir
+        # exec when it fails on a missing parent. Directory tar entries are
+        # not an option: unpacking them would reset the mode of pre-existing
+        # dirs (e.g. the sticky bit on /tmp).
         try:
-            self.container.put_archive('/', tar_stream)
+            ok = self.container.put_archive('/', tar_stream)
         except Exception as e:
-            raise Exception(f"Failed to write file: {str(e)}")
-
-        check_command = f'test -f {shlex.quote(filename)}'
-        check_result = self.container.exec_run(["sh", "-c", check_command])
-        if check_result.exit_code != 0:
+            directory = os.path.dirname(filename)
+            if not directory:
+                raise Exception(f"Failed to write file: {str(e)}")
+            mkdir_result = self.container.exec_run(["mkdir", "-p", directory])
+            if mkdir_result.exit_code != 0:
+                raise Exception(f"Failed to create directory: {mkdir_result.output.decode('utf-8')}")
+            tar_stream.seek(0)
+            try:
+                ok = self.container.put_archive('/', tar_stream)
+            except Exception as e:
+                raise Exception(f"Failed to write file: {str(e)}")
+        if not ok:
             raise Exception(f"Failed to write file: {filename}")
 
     def read_file(self, filename):
@@ -180,54 +332,99 @@ class AICodeSandbox:
         
         code = textwrap.dedent(code)
 
-        code_preview = code.strip()
-        if len(code_preview) > 200:
-            code_preview = code_preview[:197] + '...'
-        print(
-            f"[SANDBOX] Executing code (len={len(code)}): {code_preview}",
-            file=sys.stderr,
-            flush=True,
-        )
+        if _DEBUG:
+            code_preview = code.strip()
+            if len(code_preview) > 200:
+                code_preview = code_preview[:197] + '...'
+            print(
+                f"[SANDBOX] Executing code (len={len(code)}): {code_preview}",
+                file=sys.stderr,
+                flush=True,
+            )
+
+        # Fast path: without env vars the snippet can run in the warm
+        # in-container interpreter, skipping a Docker exec and CPython
+        # startup. Fall through to the one-shot exec only if the dispatcher
+        # died before the snippet was sent; after that the code may already
+        # be running, so retrying could execute side effects twice.
+        if not env_vars:
+            with self._dispatch_lock:
+                sent = False
+                try:
+                    self._ensure_dispatcher()
+                    payload = code.encode('utf-8')
+                    self._dispatch_sock._sock.sendall(
+                        str(len(payload)).encode('ascii') + b'\n' + payload
+                    )
+                    sent = True
+                    exit_code, stdout_text, stderr_text = self._read_frame()
+                except Exception:
+                    self._close_dispatcher()
+                    if sent:
+                        raise
+                else:
+                    return self._format_result(exit_code, stdout_text, stderr_text)
 
-        env_str = " ".join(f"{k}={shlex.quote(v)}" for k, v in env_vars.items())
-        escaped_code = code.replace("'", "'\"'\"'")
-        exec_command = f"env {env_str} python -c '{escaped_code}'"
-        
         t_exec_start = time.time()
-        exec_result = self.container.exec_run(
-            ["sh", "-c", exec_command],
-            demux=True
-        )
+        exec_id = self.api.exec_create(
+            self.container.id,
+            ["python", "-"],
+            environment=[f"{k}={v}" for k, v in env_vars.items()],
+            stdin=True,
+            stdout=True,
+            stderr=True,
+        )['Id']
+        sock = self.api.exec_start(exec_id, socket=True)
+        try:
+            sock._sock.sendall(code.encode('utf-8'))
+            sock._sock.shutdown(socket.SHUT_WR)
+            stdout_chunks, stderr_chunks = [], []
+            for stream, data in frames_iter(sock, tty=False):
+                if stream == 1:
+                    stdout_chunks.append(data)
+                else:
+                    stderr_chunks.append(data)
+        finally:
+            sock.close()
+        stdout = b''.join(stdout_chunks) or None
+        stderr = b''.join(stderr_chunks) or None
+        exit_code = self.api.exec_inspect(exec_id)['ExitCode']
         t_exec_end = time.time()
-        print(
-            f"[SANDBOX] container.exec_run() took {(t_exec_end - t_exec_start)*1000:.2f}ms",
-            file=sys.stderr,
-            flush=True,
-        )
-        
-        stdout, stderr = exec_result.output
 
         stdout_text = stdout.decode('utf-8') if stdout else ''
         stderr_text = stderr.decode('utf-8') if stderr else ''
 
-        print(
-            f"[SANDBOX] exit_code={exec_result.exit_code} stdout_len={len(stdout_text)} stderr_len={len(stderr_text)}",
-            file=sys.stderr,
-            flush=True,
-        )
+        if _DEBUG:
+            print(
+                f"[SANDBOX] exec took {(t_exec_end - t_exec_start)*1000:.2f}ms",
+                file=sys.stderr,
+                flush=True,
+            )
+
+        return self._format_result(exit_code, stdout_text, stderr_text)
 
-        if exec_result.exit_code != 0:
-            error_preview = stderr_text.strip() or stdout_text.strip()
-            if len(error_preview) > 200:
-                error_preview = error_preview[:197] + '...'
+    def _format_result(self, exit_code, stdout_text, stderr_text):
+        """Turn an execution's exit code and output into run_code's result string."""
+        if _DEBUG:
             print(
-                f"[SANDBOX] execution failed: {error_preview}",
+                f"[SANDBOX] exit_code={exit_code} stdout_len={len(stdout_text)} stderr_len={len(stderr_text)}",
                 file=sys.stderr,
                 flush=True,
             )
-            return f"Error (exit code {exec_result.exit_code}): {stderr_text}"
 
-        if stdout_text:
+        if exit_code != 0:
+            if _DEBUG:
+                error_preview = stderr_text.strip() or stdout_text.strip()
+                if len(error_preview) > 200:
+                    error_preview = error_preview[:197] + '...'
+                print(
+                    f"[SANDBOX] execution failed: {error_preview}",
+                    file=sys.stderr,
+                    flush=True,
+                )
+            return f"Error (exit code {exit_code}): {stderr_text}"
+
+        if _DEBUG and stdout_text:
             preview = stdout_text.strip()
             if len(preview) > 200:
                 preview = preview[:197] + '...'
@@ -237,7 +434,7 @@ class AICodeSandbox:
                 flush=True,
             )
 
-        if stderr_text:
+        if _DEBUG and stderr_text:
             preview = stderr_text.strip()
             if len(preview) > 200:
                 preview = preview[:197] + '...'
@@ -253,12 +450,146 @@ class AICodeSandbox:
             return f"Error: {stderr_text}"
         return "No output"
 
+    def _ensure_dispatcher(self):
+        """Start the in-container dispatcher interpreter if not yet running."""
+        if self._dispatch_sock is not None:
+            return
+        exec_id = self.api.exec_create(
+            self.container.id,
+            ["python", "-u", "-c", _DISPATCHER_SRC],
+            stdin=True,
+            stdout=True,
+            stderr=True,
+        )['Id']
+        self._dispatch_sock = self.api.exec_start(exec_id, socket=True)
+        # A wedged interpreter must surface as an error, not hang the caller
+        # forever waiting on the socket.
+        self._dispatch_sock._sock.settimeout(_DISPATCH_TIMEOUT)
+        self._dispatch_frames = self._socket_frames()
+        self._dispatch_buf = b''
+
+    def _socket_frames(self):
+        """
+        Demultiplex stream frames from the dispatcher socket.
+
+        Reads the 8-byte docker stream headers directly so the socket timeout
+        is honored; docker's frames_iter blocks in poll() without a timeout,
+        which would wait forever on a wedged interpreter. Yields
+        (stream, data) tuples like frames_iter and returns on EOF.
+        """
+        sock = self._dispatch_sock._sock
+
+        def recv_exactly(n):
+            buf = b''
+            while len(buf) < n:
+                data = sock.recv(n - len(buf))
+                if not data:
+                    if buf:
+                        raise Exception("Sandbox dispatcher sent a truncated frame")
+                    return None
+                buf += data
+            return buf
+
+        while True:
+            header = recv_exactly(8)
+            if header is None:
+                return
+            stream = header[0]
+            (length,) = struct.unpack('>I', header[4:])
+            payload = recv_exactly(length) if length else b''
+            if payload is None:
+                raise Exception("Sandbox dispatcher sent a truncated frame")
+            yield stream, payload
+
+    def _close_dispatcher(self):
+        """Tear down the dispatcher exec socket, if any."""
+        if self._dispatch_sock is not None:
+            try:
+                self._dispatch_sock.close()
+            except Exception:
+                pass
+            self._dispatch_sock = None
+            self._dispatch_frames = None
+            self._dispatch_buf = b''
+
+    def _read_frame(self):
+        """
+        Read one dispatcher reply.
+
+        Replies are "<exit_code> <stdout-bytes> <stderr-bytes>\\n" followed by
+        the stdout payload then the stderr payload. Returns a tuple of
+        (exit_code, stdout_text, stderr_text).
+        """
+        stderr_data = b''
+        while b'\n' not in self._dispatch_buf:
+            for stream, data in self._dispatch_frames:
+                if stream == 1:
+                    self._dispatch_buf += data
+                    break
+                stderr_data += data
+            else:
+                raise Exception(
+                    f"Sandbox dispatcher exited: {stderr_data.decode('utf-8', errors='replace')}"
+                )
+        header, self._dispatch_buf = self._dispatch_buf.split(b'\n', 1)
+        exit_code, n_out, n_err = (int(field) for field in header.split())
+        needed = n_out + n_err
+        while len(self._dispatch_buf) < needed:
+            for stream, data in self._dispatch_frames:
+                if stream == 1:
+                    self._dispatch_buf += data
+                    break
+            else:
+                raise Exception("Sandbox dispatcher exited mid-frame")
+        payload, self._dispatch_buf = self._dispatch_buf[:needed], self._dispatch_buf[needed:]
+        return (
+            exit_code,
+            payload[:n_out].decode('utf-8'),
+            payload[n_out:].decode('utf-8'),
+        )
+
+    def _dispatch(self, code):
+        """Send one snippet to the warm interpreter, return (exit_code, stdout, stderr)."""
+        payload = code.encode('utf-8')
+        self._dispatch_sock._sock.sendall(str(len(payload)).encode('ascii') + b'\n' + payload)
+        return self._read_frame()
+
+    def run_code_batch(self, codes):
+        """
+        Execute multiple Python code snippets in a single warm interpreter.
+
+        Snippets are dispatched over stdin to one long-lived python process
+        inside the container, so the ~20ms Docker exec overhead and CPython
+        startup cost are paid once for the whole batch instead of per snippet.
+        Each snippet runs with fresh globals; its result string follows the
+        same conventions as run_code (output, or an "Error ..." message).
+
+        Args:
+            codes (list): Python code snippets to execute in order.
+
+        Returns:
+            list: Output string for each snippet, in the same order.
+        """
+        results = []
+        with self._dispatch_lock:
+            try:
+                self._ensure_dispatcher()
+                for code in codes:
+                    exit_code, stdout_text, stderr_text = self._dispatch(textwrap.dedent(code))
+                    results.append(self._format_result(exit_code, stdout_text, stderr_text))
+            except Exception:
+                self._close_dispatcher()
+                raise
+        return results
+
     def close(self):
         """
         Remove all resources created by this sandbox.
 
         This method should be called when the sandbox is no longer needed to clean up Docker resources.
         """
+        self._close_dispatcher()
+
         if self.container:
             # Never stop or remove the persistent container
             if self.container.name != "sandbox_persistent":
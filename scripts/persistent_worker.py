@@ -10,18 +10,110 @@ import json
 import traceback
 import time
 import subprocess
+import shlex
+import atexit
+import os
+
+# orjson serializes straight to bytes and is several times faster than the
+# stdlib on multi-KB payloads; fall back to stdlib json when unavailable.
+try:
+    import orjson
+
+    def _loads(data):
+        return orjson.loads(data)
+
+    def _dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def _loads(data):
+        return json.loads(data)
+
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+# Per-request logging is off by default; each flush costs a write syscall.
+_DEBUG = bool(os.environ.get("SANDBOX_DEBUG"))
+
+# Import once at startup; failures are kept so they can be reported as
+# JSON per request instead of killing the worker.
+try:
+    import docker
+    from ai_code_sandbox import AICodeSandbox
+    _IMPORT_ERROR = None
+except Exception as e:
+    docker = None
+    AICodeSandbox = None
+    _IMPORT_ERROR = e
+
+# Warm sandboxes reused across requests, keyed by packages tuple.
+_SANDBOXES = {}
+
+def _get_sandbox(packages):
+    """Return a cached AICodeSandbox for this package set, creating it once."""
+    if AICodeSandbox is None:
+        raise ImportError(f"failed to import ai_code_sandbox: {_IMPORT_ERROR}")
+    key = tuple(sorted(packages)) if packages else None
+    sandbox = _SANDBOXES.get(key)
+    if sandbox is None:
+        sandbox = AICodeSandbox(packages=packages)
+        _SANDBOXES[key] = sandbox
+    return sandbox
+
+def _evict_sandbox(packages):
+    """Drop a cached sandbox whose container has gone away."""
+    key = tuple(sorted(packages)) if packages else None
+    sandbox = _SANDBOXES.pop(key, None)
+    if sandbox is not None:
+        try:
+            sandbox.close()
+        except Exception:
+            pass
+
+def _close_sandboxes():
+    """Close all cached sandboxes on worker shutdown."""
+    for sandbox in _SANDBOXES.values():
+        try:
+            sandbox.close()
+        except Exception:
+            pass
+    _SANDBOXES.clear()
+
+atexit.register(_close_sandboxes)
 
 def execute_bash(code):
     """Execute bash code and return stdout/stderr."""
     try:
-        result = subprocess.run(
-            code,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=30,
-            preexec_fn=None  # Windows compatibility
-        )
+        # Simple commands (no shell metacharacters, including ~ which needs
+        # tilde expansion and # which starts a comment) run directly, skipping
+        # the fork+exec of an intermediary sh -c.
+        needs_shell = any(c in code for c in ';|&<>*?`$(){}[]~#\n')
+        if not needs_shell:
+            try:
+                args = shlex.split(code)
+            except ValueError:
+                args, needs_shell = code, True
+        else:
+            args = code
+        try:
+            result = subprocess.run(
+                args,
+                shell=needs_shell,
+                capture_output=True,
+                text=True,
+                timeout=30,
+                preexec_fn=None  # Windows compatibility
+            )
+        except FileNotFoundError:
+            # Shell builtins like cd and export have no binary to exec
+            # directly; rerun through the shell
+            result = subprocess.run(
+                code,
+                shell=True,
+                capture_output=True,
+                text=True,
+                timeout=30,
+                preexec_fn=None  # Windows compatibility
+            )
         return result.stdout, result.stderr, result.returncode
     except subprocess.TimeoutExpired as e:
         # Ensure process is killed on timeout
@@ -40,10 +132,40 @@ def process_request(request_data):
     
     try:
         code = request_data.get('code')
+        codes = request_data.get('codes')
         language = request_data.get('language', 'python')  # Default to python
         packages = request_data.get('packages') or None
         request_id = request_data.get('id', 'unknown')
-        
+
+        # Handle batched execution: all snippets share one warm in-container
+        # interpreter, amortizing the per-exec Docker overhead across the batch
+        if language == 'batch' or isinstance(codes, list):
+            if not isinstance(codes, list) or not codes:
+                return {"id": request_id, "success": False, "error": "missing or empty codes", "timings": timings}
+
+            t_sandbox = time.perf_counter()
+            sandbox = _get_sandbox(packages)
+            timings['sandbox_init_ms'] = (time.perf_counter() - t_sandbox) * 1000
+
+            t_exec = time.perf_counter()
+            try:
+                results = sandbox.run_code_batch(codes)
+            except (docker.errors.NotFound, docker.errors.APIError):
+                # The container can vanish mid-run (daemon restart, OOM kill);
+                # rebuilding the sandbox recreates or restarts it
+                _evict_sandbox(packages)
+                sandbox = _get_sandbox(packages)
+                results = sandbox.run_code_batch(codes)
+            timings['code_exec_ms'] = (time.perf_counter() - t_exec) * 1000
+            timings['total_ms'] = (time.perf_counter() - t_start) * 1000
+            if _DEBUG:
+                print(
+                    f"[WORKER] request={request_id} batch_success=True n={len(results)} total_ms={timings['total_ms']:.2f}",
+                    file=sys.stderr,
+                    flush=True,
+                )
+            return {"id": request_id, "success": True, "results": results, "timings": timings}
+
         if not isinstance(code, str) or not code.strip():
             return {"id": request_id, "success": False, "error": "missing or empty code", "timings": timings}
 
@@ -55,11 +177,12 @@ def process_request(request_data):
             timings['total_ms'] = (time.perf_counter() - t_start) * 1000
             
             if returncode != 0:
-                print(
-                    f"[WORKER] request={request_id} bash_exit_code={returncode} stderr_len={len(stderr)}",
-                    file=sys.stderr,
-                    flush=True,
-                )
+                if _DEBUG:
+                    print(
+                        f"[WORKER] request={request_id} bash_exit_code={returncode} stderr_len={len(stderr)}",
+                        file=sys.stderr,
+                        flush=True,
+                    )
                 return {
                     "id": request_id,
                     "success": False,
@@ -69,34 +192,29 @@ def process_request(request_data):
                     "timings": timings
                 }
             else:
-                print(
-                    f"[WORKER] request={request_id} bash_success=True total_ms={timings['total_ms']:.2f} stdout_len={len(stdout)}",
-                    file=sys.stderr,
-                    flush=True,
-                )
+                if _DEBUG:
+                    print(
+                        f"[WORKER] request={request_id} bash_success=True total_ms={timings['total_ms']:.2f} stdout_len={len(stdout)}",
+                        file=sys.stderr,
+                        flush=True,
+                    )
                 return {"id": request_id, "success": True, "result": stdout, "timings": timings}
         
         # Handle Python execution (original behavior)
-        # Import on first request, then cached
-        if 'AICodeSandbox' not in dir():
-            t_import = time.perf_counter()
-            try:
-                from ai_code_sandbox import AICodeSandbox
-            except Exception as e:
-                return {"id": request_id, "success": False, "error": f"failed to import: {e}", "timings": timings}
-            timings['import_ms'] = (time.perf_counter() - t_import) * 1000
-        else:
-            timings['import_ms'] = 0  # Already imported
-        
-        sandbox = None
         try:
             t_sandbox = time.perf_counter()
-            from ai_code_sandbox import AICodeSandbox
-            sandbox = AICodeSandbox(packages=packages)
+            sandbox = _get_sandbox(packages)
             timings['sandbox_init_ms'] = (time.perf_counter() - t_sandbox) * 1000
             
             t_exec = time.perf_counter()
-            result = sandbox.run_code(code)
+            try:
+                result = sandbox.run_code(code)
+            except (docker.errors.NotFound, docker.errors.APIError):
+                # The container can vanish mid-run (daemon restart, OOM kill);
+                # rebuilding the sandbox recreates or restarts it
+                _evict_sandbox(packages)
+                sandbox = _get_sandbox(packages)
+                result = sandbox.run_code(code)
             timings['code_exec_ms'] = (time.perf_counter() - t_exec) * 1000
             
             # Normalize result
@@ -105,36 +223,33 @@ def process_request(request_data):
                 out = str(out)
             
             timings['total_ms'] = (time.perf_counter() - t_start) * 1000
-            print(
-                f"[WORKER] request={request_id} success=True total_ms={timings['total_ms']:.2f} stdout_len={len(out)}",
-                file=sys.stderr,
-                flush=True,
-            )
+            if _DEBUG:
+                print(
+                    f"[WORKER] request={request_id} success=True total_ms={timings['total_ms']:.2f} stdout_len={len(out)}",
+                    file=sys.stderr,
+                    flush=True,
+                )
             return {"id": request_id, "success": True, "result": out, "timings": timings}
             
         except Exception as e:
             tb = traceback.format_exc()
             timings['total_ms'] = (time.perf_counter() - t_start) * 1000
+            if _DEBUG:
+                print(
+                    f"[WORKER] request={request_id} raised {e}",
+                    file=sys.stderr,
+                    flush=True,
+                )
+            return {"id": request_id, "success": False, "error": str(e), "traceback": tb, "timings": timings}
+
+    except Exception as e:
+        timings['total_ms'] = (time.perf_counter() - t_start) * 1000
+        if _DEBUG:
             print(
-                f"[WORKER] request={request_id} raised {e}" ,
+                f"[WORKER] request={request_id} failed before execution: {e}",
                 file=sys.stderr,
                 flush=True,
             )
-            return {"id": request_id, "success": False, "error": str(e), "traceback": tb, "timings": timings}
-        finally:
-            try:
-                if sandbox:
-                    sandbox.close()
-            except:
-                pass
-    
-    except Exception as e:
-        timings['total_ms'] = (time.perf_counter() - t_start) * 1000
-        print(
-            f"[WORKER] request={request_id} failed before execution: {e}",
-            file=sys.stderr,
-            flush=True,
-        )
         return {"id": request_id, "success": False, "error": str(e), "timings": timings}
 
 def main():
@@ -149,28 +264,30 @@ def main():
             
             t_recv = time.perf_counter()
             try:
-                request = json.loads(line)
+                request = _loads(line)
                 t_parse = time.perf_counter()
-                
+
                 response = process_request(request)
                 t_process = time.perf_counter()
-                
-                json_str = json.dumps(response)
+
+                json_bytes = _dumps(response)
                 t_serialize = time.perf_counter()
-                
-                print(json_str, flush=True)
-                sys.stdout.flush()
+
+                sys.stdout.buffer.write(json_bytes + b"\n")
+                sys.stdout.buffer.flush()
                 t_output = time.perf_counter()
                 
                 # Log timing breakdown
-                print(f"[WORKER_TIMING] recv->parse={((t_parse-t_recv)*1000):.2f}ms process={((t_process-t_parse)*1000):.2f}ms serialize={((t_serialize-t_process)*1000):.2f}ms output={((t_output-t_serialize)*1000):.2f}ms", file=sys.stderr, flush=True)
+                if _DEBUG:
+                    print(f"[WORKER_TIMING] recv->parse={((t_parse-t_recv)*1000):.2f}ms process={((t_process-t_parse)*1000):.2f}ms serialize={((t_serialize-t_process)*1000):.2f}ms output={((t_output-t_serialize)*1000):.2f}ms", file=sys.stderr, flush=True)
                 
-            except json.JSONDecodeError as e:
-                print(json.dumps({"success": False, "error": f"invalid json: {e}"}), flush=True)
-                sys.stdout.flush()
+            except ValueError as e:
+                # Both orjson and stdlib json raise ValueError subclasses on bad input
+                sys.stdout.buffer.write(_dumps({"success": False, "error": f"invalid json: {e}"}) + b"\n")
+                sys.stdout.buffer.flush()
             except Exception as e:
-                print(json.dumps({"success": False, "error": str(e)}), flush=True)
-                sys.stdout.flush()
+                sys.stdout.buffer.write(_dumps({"success": False, "error": str(e)}) + b"\n")
+                sys.stdout.buffer.flush()
     except KeyboardInterrupt:
         print("[WORKER] Shutting down", file=sys.stderr, flush=True)
         sys.exit(0)
@@ -1,8 +1,9 @@
 import sys
 import os
+import subprocess
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from ai_code_sandbox.sandbox import AICodeSandbox
+from ai_code_sandbox.sandbox import AICodeSandbox, _DISPATCHER_SRC
 
 def test_sandbox():
     sandbox = AICodeSandbox(packages=[])
@@ -13,7 +14,78 @@ def test_sandbox():
         """
         
         result = sandbox.run_code(code)
-        
+
         assert "Hello, world!" in result
     finally:
-        sandbox.close()
\ No newline at end of file
+        sandbox.close()
+
+def test_dispatcher_protocol():
+    # The dispatcher is plain Python, so its wire protocol can be exercised
+    # without a Docker daemon by running it as a local subprocess.
+    proc = subprocess.Popen(
+        [sys.executable, "-u", "-c", _DISPATCHER_SRC],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+
+    def send(code):
+        payload = code.encode('utf-8')
+        proc.stdin.write(str(len(payload)).encode('ascii') + b'\n' + payload)
+        proc.stdin.flush()
+
+    def recv():
+        exit_code, n_out, n_err = (int(field) for field in proc.stdout.readline().split())
+        payload = proc.stdout.read(n_out + n_err)
+        return exit_code, payload[:n_out].decode('utf-8'), payload[n_out:].decode('utf-8')
+
+    try:
+        send("print('hello')")
+        assert recv() == (0, "hello\n", "")
+
+        send("1/0")
+        exit_code, stdout, stderr = recv()
+        assert exit_code == 1
+        assert stdout == ""
+        assert "ZeroDivisionError" in stderr
+
+        send("import sys; sys.exit(3)")
+        assert recv()[0] == 3
+
+        send("import sys; print('out'); print('err', file=sys.stderr)")
+        assert recv() == (0, "out\n", "err\n")
+
+        # fd-level writes are captured and must not corrupt the protocol
+        send("import os; os.write(1, b'raw-fd-output\\n')")
+        assert recv() == (0, "raw-fd-output\n", "")
+
+        send("import subprocess; subprocess.run(['echo', 'from-subprocess'])")
+        assert recv() == (0, "from-subprocess\n", "")
+
+        # stdin reads hit EOF instead of stealing protocol bytes or hanging
+        send("x = input()")
+        exit_code, stdout, stderr = recv()
+        assert exit_code == 1
+        assert "EOFError" in stderr
+
+        send("import sys; print(repr(sys.stdin.read()))")
+        assert recv() == (0, "''\n", "")
+
+        # A failing snippet must not kill the interpreter
+        send("print('still alive')")
+        assert recv() == (0, "still alive\n", "")
+    finally:
+        proc.stdin.close()
+        proc.wait(timeout=10)
+
+def test_read_frame_reassembles_split_frames():
+    sandbox = AICodeSandbox.__new__(AICodeSandbox)
+    reply = b"0 3 4\nout" + b"err\n"
+    sandbox._dispatch_buf = b''
+    # The reply arrives split across stdout frames, with dispatcher stderr
+    # noise interleaved, which _read_frame must skip over
+    sandbox._dispatch_frames = iter([
+        (1, reply[:4]),
+        (2, b'ignored diagnostics'),
+        (1, reply[4:]),
+    ])
+    assert sandbox._read_frame() == (0, "out", "err\n")
\ No newline at end of file